@@ -1,8 +1,10 @@
 import os
 from datetime import datetime
 from flask import Flask, render_template, request, redirect, url_for, flash
-from models import db, User, Firm, Contact, Project, Note
-from sqlalchemy import or_, desc
+from models import (db, User, Firm, Contact, Project, Note, SavedSearch,
+                    ProjectStatusRollup, UserWeeklyNotesRollup, search_filters)
+from reporting import count_search_results, inactive_firms, last_refreshed_at
+from sqlalchemy import desc
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -25,27 +27,10 @@ def index():
     projects = []
     
     if search_query:
-        firms = Firm.query.filter(
-            or_(
-                Firm.name.ilike(f'%{search_query}%'),
-                Firm.industry.ilike(f'%{search_query}%')
-            )
-        ).all()
-        
-        contacts = Contact.query.filter(
-            or_(
-                Contact.first_name.ilike(f'%{search_query}%'),
-                Contact.last_name.ilike(f'%{search_query}%'),
-                Contact.email.ilike(f'%{search_query}%')
-            )
-        ).all()
-        
-        projects = Project.query.filter(
-            or_(
-                Project.name.ilike(f'%{search_query}%'),
-                Project.description.ilike(f'%{search_query}%')
-            )
-        ).all()
+        filters = search_filters(search_query)
+        firms = Firm.query.filter(filters[Firm]).all()
+        contacts = Contact.query.filter(filters[Contact]).all()
+        projects = Project.query.filter(filters[Project]).all()
     
     # Recent activity feed - get recent notes with filtering
     notes_query = Note.query
@@ -73,6 +58,53 @@ def index():
                          activity_filter=activity_filter)
 
 
+@app.route('/dashboard')
+def dashboard():
+    """Management dashboard, served entirely from the reporting rollups"""
+    status_rows = ProjectStatusRollup.query.order_by(
+        ProjectStatusRollup.industry, ProjectStatusRollup.status
+    ).all()
+    
+    # Pivot into industry -> {status: count} for the table
+    statuses = sorted({row.status for row in status_rows})
+    projects_by_industry = {}
+    for row in status_rows:
+        projects_by_industry.setdefault(row.industry, {})[row.status] = row.project_count
+    
+    weekly_notes = UserWeeklyNotesRollup.query.order_by(
+        desc(UserWeeklyNotesRollup.week_start), UserWeeklyNotesRollup.username
+    ).limit(50).all()
+    
+    saved_searches = SavedSearch.query.order_by(SavedSearch.name).all()
+    
+    return render_template('dashboard.html',
+                         statuses=statuses,
+                         projects_by_industry=projects_by_industry,
+                         weekly_notes=weekly_notes,
+                         inactive_firms=inactive_firms(),
+                         saved_searches=saved_searches,
+                         last_refreshed_at=last_refreshed_at())
+
+
+@app.route('/saved-search/add', methods=['POST'])
+def saved_search_add():
+    """Save a global search; its result count is kept current by the rollup refresh"""
+    search_query = request.form.get('search_query', '').strip()
+    name = request.form.get('name', '').strip() or search_query
+    
+    if not search_query:
+        flash('Search query is required', 'error')
+        return redirect(request.referrer or url_for('index'))
+    
+    search = SavedSearch(name=name, search_query=search_query,
+                         result_count=count_search_results(search_query),
+                         counted_at=datetime.utcnow())
+    db.session.add(search)
+    db.session.commit()
+    flash(f'Search "{search.name}" saved successfully!', 'success')
+    return redirect(url_for('dashboard'))
+
+
 @app.route('/firms')
 def firms_list():
     """List all firms"""
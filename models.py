@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import or_
 
 db = SQLAlchemy()
 
@@ -132,3 +133,91 @@ class Note(db.Model):
         elif self.project_id:
             return self.project
         return None
+
+
+# Reporting rollups, refreshed by refresh_reports.py (see reporting.py)
+
+class ReportWatermark(db.Model):
+    """Newest created_at/updated_at already folded into a rollup, per source table"""
+    __tablename__ = 'report_watermarks'
+
+    key = db.Column(db.String(100), primary_key=True)  # '<rollup>:<source table>' or 'refresh_lock'
+    value = db.Column(db.DateTime)
+    refreshed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ReportWatermark {self.key} {self.value}>'
+
+
+class ProjectFact(db.Model):
+    """Last seen industry and status of each project, so changes can be applied as deltas"""
+    __tablename__ = 'report_project_facts'
+
+    project_id = db.Column(db.Integer, primary_key=True)
+    firm_id = db.Column(db.Integer, nullable=False, index=True)  # facts to re-read when a firm's industry changes
+    industry = db.Column(db.String(100), nullable=False, default='')
+    status = db.Column(db.String(50), nullable=False, default='')
+
+
+class ProjectStatusRollup(db.Model):
+    """Project counts by status per firm industry"""
+    __tablename__ = 'report_project_status'
+
+    industry = db.Column(db.String(100), primary_key=True)  # '' when the firm has no industry
+    status = db.Column(db.String(50), primary_key=True)
+    project_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class UserWeeklyNotesRollup(db.Model):
+    """Note counts per user per week (weeks start on Monday)"""
+    __tablename__ = 'report_user_weekly_notes'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    week_start = db.Column(db.Date, primary_key=True)
+    username = db.Column(db.String(80))
+    note_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class FirmActivityRollup(db.Model):
+    """Most recent activity per firm: firm edits, contact/project edits and notes"""
+    __tablename__ = 'report_firm_activity'
+
+    firm_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    industry = db.Column(db.String(100))
+    last_activity_at = db.Column(db.DateTime, index=True)
+
+
+class SavedSearch(db.Model):
+    """Named global search whose result count is precomputed by the rollup refresh"""
+    __tablename__ = 'saved_searches'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    search_query = db.Column(db.String(200), nullable=False)
+    result_count = db.Column(db.Integer)
+    counted_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SavedSearch {self.name}>'
+
+
+def search_filters(search_query):
+    """Filters used by the global search for firms, contacts and projects"""
+    pattern = f'%{search_query}%'
+    return {
+        Firm: or_(
+            Firm.name.ilike(pattern),
+            Firm.industry.ilike(pattern)
+        ),
+        Contact: or_(
+            Contact.first_name.ilike(pattern),
+            Contact.last_name.ilike(pattern),
+            Contact.email.ilike(pattern)
+        ),
+        Project: or_(
+            Project.name.ilike(pattern),
+            Project.description.ilike(pattern)
+        ),
+    }
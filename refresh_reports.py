@@ -0,0 +1,33 @@
+"""
+Refresh the reporting rollups used by the dashboard and saved searches.
+
+Only rows created or updated since the previous run are read, so this is meant
+to be scheduled frequently, e.g. from cron:
+
+    */15 * * * * cd /path/to/minicrm && python refresh_reports.py
+
+Pass --full to discard the rollups and rebuild them from every row.
+"""
+import argparse
+from app import app, db
+from reporting import refresh_rollups
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Refresh reporting rollups')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild all rollups from scratch instead of incrementally')
+    args = parser.parse_args()
+    
+    with app.app_context():
+        # Databases created before the reporting tables existed need them added
+        db.create_all()
+        stats = refresh_rollups(full=args.full)
+    
+    print("Reporting rollups refreshed" + (" (full rebuild)" if args.full else ""))
+    for rollup, rows in stats.items():
+        print(f"  {rollup}: {rows} rows processed")
+
+
+if __name__ == '__main__':
+    main()
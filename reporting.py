@@ -0,0 +1,374 @@
+"""
+Reporting rollups for the management dashboard and saved searches.
+
+The dashboard never aggregates over projects, notes or firms directly. It reads
+small rollup tables (see models.py) that refresh_reports.py keeps up to date by
+only looking at rows whose created_at/updated_at is newer than the watermark
+recorded by the previous refresh.
+
+Timestamps are set by the application when a row is flushed, not when its
+transaction commits, so watermarks are held back by WATERMARK_LAG and every
+refresh re-reads that overlap. Each rollup is therefore updated idempotently.
+"""
+from datetime import datetime, timedelta
+from models import (db, User, Firm, Contact, Project, Note, ReportWatermark, ProjectFact,
+                    ProjectStatusRollup, UserWeeklyNotesRollup, FirmActivityRollup,
+                    SavedSearch, search_filters)
+from sqlalchemy import or_, and_, func, true
+from sqlalchemy.exc import IntegrityError
+
+INACTIVE_DAYS = 90
+WATERMARK_LAG = timedelta(minutes=10)
+SAVED_SEARCH_INTERVAL = timedelta(hours=1)
+LOCK_KEY = 'refresh_lock'
+
+
+def count_search_results(search_query):
+    """Total number of global search results for a query"""
+    return sum(model.query.filter(criterion).count()
+               for model, criterion in search_filters(search_query).items())
+
+
+def week_start(value):
+    """Monday of the week a datetime falls in"""
+    day = value.date()
+    return day - timedelta(days=day.weekday())
+
+
+def _get_watermark(key):
+    mark = db.session.get(ReportWatermark, key)
+    return mark.value if mark else None
+
+
+def _set_watermark(key, value, now, lag=WATERMARK_LAG):
+    mark = db.session.get(ReportWatermark, key)
+    if not mark:
+        mark = ReportWatermark(key=key)
+        db.session.add(mark)
+    # Rows stamped within the lag may still be uncommitted; leave them for the next run
+    if value:
+        value = min(value, now - lag)
+    if value and (mark.value is None or value > mark.value):
+        mark.value = value
+    mark.refreshed_at = now
+
+
+def _newer_than(column, since):
+    """Filter for rows past a watermark; everything when there is no watermark yet"""
+    return column > since if since else true()
+
+
+def _latest(current, value):
+    if value is None:
+        return current
+    return value if current is None or value > current else current
+
+
+def _refresh_project_status(now):
+    """Apply project status/industry changes to the status-per-industry rollup"""
+    since_projects = _get_watermark('project_status:projects')
+    since_firms = _get_watermark('project_status:firms')
+
+    project_rows = db.session.query(
+        Project.id, Project.firm_id, Project.status, Project.updated_at, Firm.industry
+    ).join(Firm, Project.firm_id == Firm.id).filter(
+        _newer_than(Project.updated_at, since_projects)
+    ).all()
+
+    firm_rows = db.session.query(
+        Firm.id, Firm.industry, Firm.updated_at
+    ).filter(_newer_than(Firm.updated_at, since_firms)).all()
+    firm_industries = {firm_id: industry or '' for firm_id, industry, _ in firm_rows}
+
+    # Facts for changed projects, plus every project of a firm whose industry may have changed
+    fact_query = ProjectFact.query
+    if since_projects and since_firms:
+        fact_query = fact_query.filter(or_(
+            ProjectFact.project_id.in_([row[0] for row in project_rows]),
+            ProjectFact.firm_id.in_(firm_industries.keys())
+        ))
+    facts = {fact.project_id: fact for fact in fact_query}
+    rollups = {(r.industry, r.status): r for r in ProjectStatusRollup.query.all()}
+
+    def bump(industry, status, delta):
+        rollup = rollups.get((industry, status))
+        if not rollup:
+            rollup = ProjectStatusRollup(industry=industry, status=status, project_count=0)
+            db.session.add(rollup)
+            rollups[(industry, status)] = rollup
+        rollup.project_count += delta
+
+    def apply(fact, industry, status):
+        if (fact.industry, fact.status) != (industry, status):
+            bump(fact.industry, fact.status, -1)
+            bump(industry, status, 1)
+            fact.industry = industry
+            fact.status = status
+
+    latest_project = None
+    for project_id, firm_id, status, updated_at, industry in project_rows:
+        industry = industry or ''
+        status = status or ''
+        fact = facts.get(project_id)
+        if not fact:
+            fact = ProjectFact(project_id=project_id, firm_id=firm_id,
+                               industry=industry, status=status)
+            db.session.add(fact)
+            facts[project_id] = fact
+            bump(industry, status, 1)
+        else:
+            apply(fact, industry, status)
+        fact.firm_id = firm_id
+        latest_project = _latest(latest_project, updated_at)
+
+    for fact in facts.values():
+        if fact.firm_id in firm_industries:
+            apply(fact, firm_industries[fact.firm_id], fact.status)
+    latest_firm = None
+    for _, _, updated_at in firm_rows:
+        latest_firm = _latest(latest_firm, updated_at)
+
+    for rollup in rollups.values():
+        if rollup.project_count <= 0:
+            db.session.delete(rollup)
+
+    _set_watermark('project_status:projects', latest_project, now)
+    _set_watermark('project_status:firms', latest_firm, now)
+    return len(project_rows) + len(firm_rows)
+
+
+def _refresh_weekly_notes(now):
+    """Recount the per-user weekly buckets that received new notes"""
+    since = _get_watermark('weekly_notes:notes')
+
+    rows = db.session.query(
+        Note.user_id, User.username, Note.created_at
+    ).join(User, Note.user_id == User.id).filter(
+        _newer_than(Note.created_at, since)
+    ).all()
+
+    buckets = set()
+    usernames = {}
+    latest = None
+    for user_id, username, created_at in rows:
+        if created_at is None:
+            continue
+        buckets.add((user_id, week_start(created_at)))
+        usernames[user_id] = username
+        latest = _latest(latest, created_at)
+
+    # Recount whole buckets rather than adding deltas, so re-reading the
+    # watermark overlap never counts a note twice
+    counts = {}
+    rollups = {}
+    if buckets:
+        weeks = {week for _, week in buckets}
+        first = datetime.combine(min(weeks), datetime.min.time())
+        last = datetime.combine(max(weeks), datetime.min.time()) + timedelta(days=7)
+        bucket_notes = db.session.query(Note.user_id, Note.created_at).filter(
+            Note.user_id.in_(usernames.keys()),
+            Note.created_at >= first,
+            Note.created_at < last
+        ).all()
+        for user_id, created_at in bucket_notes:
+            key = (user_id, week_start(created_at))
+            if key in buckets:
+                counts[key] = counts.get(key, 0) + 1
+
+        rollups = {(r.user_id, r.week_start): r for r in UserWeeklyNotesRollup.query.filter(
+            UserWeeklyNotesRollup.user_id.in_(usernames.keys()),
+            UserWeeklyNotesRollup.week_start.in_(weeks)
+        )}
+
+    for user_id, week in buckets:
+        rollup = rollups.get((user_id, week))
+        if not rollup:
+            rollup = UserWeeklyNotesRollup(user_id=user_id, week_start=week)
+            db.session.add(rollup)
+        rollup.username = usernames[user_id]
+        rollup.note_count = counts.get((user_id, week), 0)
+
+    _set_watermark('weekly_notes:notes', latest, now)
+    return len(rows)
+
+
+def _refresh_firm_activity(now):
+    """Move each firm's last activity forward from edits and new notes
+
+    Returns the number of rows read and the newest firm/contact/project change among them.
+    """
+    since_firms = _get_watermark('firm_activity:firms')
+    since_contacts = _get_watermark('firm_activity:contacts')
+    since_projects = _get_watermark('firm_activity:projects')
+    since_notes = _get_watermark('firm_activity:notes')
+
+    firms = db.session.query(
+        Firm.id, Firm.name, Firm.industry, Firm.created_at, Firm.updated_at
+    ).filter(_newer_than(Firm.updated_at, since_firms)).all()
+
+    contact_changes = db.session.query(
+        Contact.firm_id, Contact.updated_at
+    ).filter(_newer_than(Contact.updated_at, since_contacts)).all()
+
+    project_changes = db.session.query(
+        Project.firm_id, Project.updated_at
+    ).filter(_newer_than(Project.updated_at, since_projects)).all()
+
+    # Notes can be attached to the firm itself or to one of its contacts/projects
+    note_changes = db.session.query(
+        func.coalesce(Note.firm_id, Contact.firm_id, Project.firm_id), Note.created_at
+    ).outerjoin(Contact, Note.contact_id == Contact.id
+    ).outerjoin(Project, Note.project_id == Project.id
+    ).filter(_newer_than(Note.created_at, since_notes)).all()
+
+    activity = {}
+    latest = {'contacts': None, 'projects': None, 'notes': None}
+    for source, changes in (('contacts', contact_changes),
+                            ('projects', project_changes),
+                            ('notes', note_changes)):
+        for firm_id, changed_at in changes:
+            latest[source] = _latest(latest[source], changed_at)
+            if firm_id is not None:
+                activity[firm_id] = _latest(activity.get(firm_id), changed_at)
+
+    changed_firm_ids = {row[0] for row in firms}
+    rollup_query = FirmActivityRollup.query
+    if since_firms:
+        rollup_query = rollup_query.filter(
+            FirmActivityRollup.firm_id.in_(changed_firm_ids | activity.keys())
+        )
+    rollups = {rollup.firm_id: rollup for rollup in rollup_query}
+
+    # Firms without a rollup row yet (e.g. a NULL updated_at) get one here,
+    # otherwise their activity would be dropped once the watermarks move on
+    missing = activity.keys() - rollups.keys() - changed_firm_ids
+    if missing:
+        firms += db.session.query(
+            Firm.id, Firm.name, Firm.industry, Firm.created_at, Firm.updated_at
+        ).filter(Firm.id.in_(missing)).all()
+
+    latest_firm = None
+    for firm_id, name, industry, created_at, updated_at in firms:
+        rollup = rollups.get(firm_id)
+        if not rollup:
+            rollup = FirmActivityRollup(firm_id=firm_id)
+            db.session.add(rollup)
+            rollups[firm_id] = rollup
+        rollup.name = name
+        rollup.industry = industry
+        rollup.last_activity_at = _latest(rollup.last_activity_at, _latest(created_at, updated_at))
+        if firm_id in changed_firm_ids:
+            latest_firm = _latest(latest_firm, updated_at)
+
+    for firm_id, changed_at in activity.items():
+        rollup = rollups.get(firm_id)
+        if rollup:
+            rollup.last_activity_at = _latest(rollup.last_activity_at, changed_at)
+
+    _set_watermark('firm_activity:firms', latest_firm, now)
+    for source, value in latest.items():
+        _set_watermark(f'firm_activity:{source}', value, now)
+
+    last_change = _latest(latest_firm, _latest(latest['contacts'], latest['projects']))
+    rows_read = len(changed_firm_ids) + len(contact_changes) + len(project_changes) + len(note_changes)
+    return rows_read, last_change
+
+
+def _refresh_saved_searches(now):
+    """Recount out-of-date saved searches, each at most once per SAVED_SEARCH_INTERVAL
+
+    A recount is three ILIKE scans, so a search is only recounted when a firm,
+    contact or project changed after its last count. A change can commit up to
+    WATERMARK_LAG after its timestamp, so counts taken within that window
+    after the change are treated as stale too.
+    """
+    last_change = _get_watermark('saved_searches:changes')
+    stale = SavedSearch.counted_at.is_(None)
+    if last_change:
+        stale = or_(stale, and_(
+            SavedSearch.counted_at < last_change + WATERMARK_LAG,
+            SavedSearch.counted_at <= now - SAVED_SEARCH_INTERVAL
+        ))
+
+    searches = SavedSearch.query.filter(stale).all()
+    # Count everything before assigning, so nothing is written (or locked) until the commit
+    counts = [count_search_results(search.search_query) for search in searches]
+    for search, count in zip(searches, counts):
+        search.result_count = count
+        search.counted_at = now
+    db.session.commit()
+    return len(searches)
+
+
+def _acquire_refresh_lock(now):
+    """Lock the refresh row for the rest of the transaction so refreshes run one at a time
+
+    On PostgreSQL this is a row lock that only blocks other refreshes. SQLite
+    ignores FOR UPDATE, so the write below takes the database-wide write lock
+    instead, and application writes wait on it until the refresh commits.
+    """
+    lock = ReportWatermark.query.filter_by(key=LOCK_KEY).with_for_update().first()
+    if not lock:
+        try:
+            with db.session.begin_nested():
+                db.session.add(ReportWatermark(key=LOCK_KEY))
+        except IntegrityError:
+            pass  # Another refresh created it first
+        lock = ReportWatermark.query.filter_by(key=LOCK_KEY).with_for_update().first()
+    lock.refreshed_at = now
+    db.session.flush()
+
+
+def reset_rollups():
+    """Drop all rollup contents and watermarks so the refresh rebuilds from scratch
+
+    Only flushes; the caller commits together with the rebuild.
+    """
+    for model in (ProjectStatusRollup, ProjectFact, UserWeeklyNotesRollup, FirmActivityRollup):
+        model.query.delete()
+    ReportWatermark.query.filter(ReportWatermark.key != LOCK_KEY).delete()
+    SavedSearch.query.update({SavedSearch.counted_at: None})
+    db.session.flush()
+
+
+def refresh_rollups(full=False):
+    """Bring every rollup up to date, returning the number of changed rows read per rollup"""
+    now = datetime.utcnow()
+    try:
+        _acquire_refresh_lock(now)
+        if full:
+            reset_rollups()
+
+        firm_activity_rows, last_change = _refresh_firm_activity(now)
+        # Not lagged: saved searches compare it against their own count time
+        _set_watermark('saved_searches:changes', last_change, now, lag=timedelta(0))
+        stats = {
+            'project_status': _refresh_project_status(now),
+            'weekly_notes': _refresh_weekly_notes(now),
+            'firm_activity': firm_activity_rows,
+        }
+        db.session.commit()
+
+        # Saved search counts are simply overwritten, so the slow ILIKE scans
+        # run after the refresh lock has been released
+        stats['saved_searches'] = _refresh_saved_searches(datetime.utcnow())
+    except Exception:
+        db.session.rollback()
+        raise
+    return stats
+
+
+def last_refreshed_at():
+    """When the rollups were last refreshed, or None if they never have been"""
+    mark = ReportWatermark.query.filter(ReportWatermark.key != LOCK_KEY).order_by(
+        ReportWatermark.refreshed_at.desc()
+    ).first()
+    return mark.refreshed_at if mark else None
+
+
+def inactive_firms(days=INACTIVE_DAYS):
+    """Firms whose last recorded activity is older than the given number of days"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return FirmActivityRollup.query.filter(
+        FirmActivityRollup.last_activity_at < cutoff
+    ).order_by(FirmActivityRollup.last_activity_at).all()